@@ -1,36 +1,92 @@
 import streamlit as st
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
 import re
+import threading
+import time
 
 try:
-    from core.api_client import get_api_client
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from core.api_client import AuthenticationError, get_api_client
     from core.config import load_config
 except ImportError as e:
     st.error(f"Import error in chat_logic: {e}")
+    class AuthenticationError(Exception):
+        pass
     def get_api_client():
         return None
     def load_config():
         return None
 
+config = load_config()
+
+_LANGS = frozenset({'python', 'javascript', 'bash', 'sql', 'html', 'css', 'json', 'xml'})
+_FENCE_RE = re.compile(r"```(?:([A-Za-z0-9_+-]*)\n)?(.*?)```", re.DOTALL)
+_LATEX_BLOCK = re.compile(r'\\\[(.*?)\\\]', re.DOTALL)
+_LATEX_INLINE = re.compile(r'\\\((.*?)\\\)', re.DOTALL)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-stream")
+_STREAM_END = object()
+
 def initialize_chat():
     """Initialize chat and session state"""
-    config = load_config()
-    
     if 'messages' not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = deque(maxlen=config.MAX_HISTORY)
     
     if 'api_key' not in st.session_state:
         api_key = os.getenv("OPENROUTER_API_KEY") or ""
         st.session_state.api_key = api_key
     
+    if 'api_key_valid' not in st.session_state:
+        st.session_state.api_key_valid = None
+        st.session_state.api_key_check = (
+            _executor.submit(_check_api_key) if st.session_state.api_key else None
+        )
+    
+    check = st.session_state.get('api_key_check')
+    if check is not None and check.done():
+        st.session_state.api_key_valid = check.result()
+        st.session_state.api_key_check = None
+    
     if 'pending_prompt' not in st.session_state:
         st.session_state.pending_prompt = None
 
+def _check_api_key() -> bool:
+    """Validate the API key on a worker thread so the first page load is not blocked"""
+    client = get_api_client()
+    return bool(client and client.validate_api_key())
+
+_encoding = None
+
+def _load_encoding():
+    """Load the tiktoken encoding in the background; its first use downloads without a timeout"""
+    global _encoding
+    
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        _encoding = None
+
+if tiktoken is not None:
+    threading.Thread(target=_load_encoding, name="tiktoken-load", daemon=True).start()
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text, estimating ~4 characters per token until tiktoken is loaded"""
+    encoding = _encoding
+    
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    return len(text) // 4 + 1
+
 def prepare_messages() -> List[Dict[str, str]]:
     """Prepare messages for API sending"""
-    config = load_config()
-    
     messages = [
         {
             "role": "system",
@@ -38,8 +94,28 @@ def prepare_messages() -> List[Dict[str, str]]:
         }
     ]
     
-    recent_messages = st.session_state.messages[-10:] if len(st.session_state.messages) > 10 else st.session_state.messages
-    messages.extend(recent_messages)
+    budget = config.CONTEXT_WINDOW - config.MAX_TOKENS - count_tokens(messages[0]['content'])
+    recent_messages = []
+    
+    for message in reversed(st.session_state.messages):
+        tokens = message.get('_tokens')
+        if tokens is None:
+            # Only exact tiktoken counts are cached; estimates are redone once it loads
+            exact = _encoding is not None
+            tokens = count_tokens(message['content'])
+            if exact:
+                message['_tokens'] = tokens
+        
+        if tokens > budget and recent_messages:
+            break
+        
+        budget -= tokens
+        recent_messages.append(message)
+    
+    messages.extend(
+        {"role": message['role'], "content": message['content']}
+        for message in reversed(recent_messages)
+    )
     
     return messages
 
@@ -59,46 +135,117 @@ def send_message(user_input: str) -> None:
     with st.chat_message("user"):
         st.markdown(user_input)
     
-    messages = prepare_messages()
-    
-    try:
-        client = get_api_client()
-        
-        if not client.validate_api_key():
-            render_error_message("Invalid API key in .env file")
-            st.session_state.messages.pop()
-            return
-        
-    except Exception as e:
-        render_error_message(f"API connection error: {str(e)}")
-        st.session_state.messages.pop()
-        return
+    chunks = queue.Queue()
+    stop_event = threading.Event()
+    response_parts: List[str] = []
+    history_updated = False
     
     try:
         with st.chat_message("assistant"):
+            st.button("⏹️ Stop", key="stop_generation", help="Stop generating the response")
+            
             with st.spinner("🤖 Generating response..."):
                 message_placeholder = st.empty()
-                full_response = ""
                 
-                for chunk in client.create_chat_completion(messages, stream=True):
-                    if chunk:
-                        full_response += chunk
-                        message_placeholder.markdown(full_response + "▊")
+                client = get_api_client()
+                if client is None:
+                    raise ConnectionError("could not create API client")
+                
+                _executor.submit(_stream_worker, client, prepare_messages(), chunks, stop_event)
                 
-                render_message_content(full_response, message_placeholder)
+                last_flush = time.monotonic()
+                pending_chars = 0
+                
+                for delta in _iter_stream_queue(chunks):
+                    if delta is not None and delta.content:
+                        response_parts.append(delta.content)
+                        pending_chars += len(delta.content)
+                    
+                    # Idle polls (None) also redraw once per RENDER_BATCH_DELAY so a Stop click is seen
+                    now = time.monotonic()
+                    if (now - last_flush >= config.RENDER_BATCH_DELAY
+                            or pending_chars >= config.RENDER_BATCH_SIZE):
+                        message_placeholder.markdown("".join(response_parts) + "▊")
+                        last_flush = now
+                        pending_chars = 0
+                
+                full_response = "".join(response_parts)
+                rendered = preprocess_message(full_response)
+                message_placeholder.markdown(rendered, unsafe_allow_html=True)
         
+        history_updated = True
+        st.session_state.api_key_valid = True
+        st.session_state.api_key_check = None
         if full_response.strip():
             st.session_state.messages.append({
                 "role": "assistant",
-                "content": full_response
+                "content": full_response,
+                "rendered": rendered
             })
         else:
-            render_error_message("Received empty response from API")
             st.session_state.messages.pop()
+            render_error_message("Received empty response from API")
             
+    except AuthenticationError:
+        st.session_state.api_key_valid = False
+        st.session_state.api_key_check = None
+        render_error_message("Invalid API key in .env file")
+        st.session_state.messages.pop()
+    except ConnectionError as e:
+        render_error_message(f"API connection error: {str(e)}")
+        st.session_state.messages.pop()
     except Exception as e:
         render_error_message(f"Error generating response: {str(e)}")
         st.session_state.messages.pop()
+    except BaseException:
+        # Stop triggers a rerun, which Streamlit raises as a BaseException; keep what arrived
+        if not history_updated:
+            partial = "".join(response_parts)
+            if partial.strip():
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": partial
+                })
+            else:
+                st.session_state.messages.pop()
+        raise
+    finally:
+        stop_event.set()
+
+def _stream_worker(client, messages: List[Dict[str, str]], chunks: queue.Queue, stop_event: threading.Event):
+    """Consume the API stream on a worker thread and hand chunks to the script thread"""
+    stream = client.create_chat_completion(messages, stream=True)
+    
+    try:
+        for delta in stream:
+            if stop_event.is_set():
+                break
+            chunks.put(delta)
+    except Exception as e:
+        chunks.put(e)
+    finally:
+        stream.close()
+        chunks.put(_STREAM_END)
+
+def _iter_stream_queue(chunks: queue.Queue):
+    """Yield the Delta tuples produced by _stream_worker, re-raising its errors
+
+    Yields None every RENDER_BATCH_DELAY seconds while no chunk arrives, so the
+    caller can make a Streamlit call and a Stop click is not stuck behind get().
+    """
+    while True:
+        try:
+            item = chunks.get(timeout=config.RENDER_BATCH_DELAY)
+        except queue.Empty:
+            yield None
+            continue
+        
+        if item is _STREAM_END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        
+        yield item
 
 def handle_quick_prompt():
     """Handle quick prompts from UI"""
@@ -109,44 +256,51 @@ def handle_quick_prompt():
 
 def render_message_content(content: str, placeholder=None):
     """Render message content with proper LaTeX and code formatting"""
+    rendered = preprocess_message(content)
     
-    def render_to_target(markdown_content):
-        if placeholder:
-            placeholder.markdown(markdown_content, unsafe_allow_html=True)
-        else:
-            st.markdown(markdown_content, unsafe_allow_html=True)
+    if placeholder:
+        placeholder.markdown(rendered, unsafe_allow_html=True)
+    else:
+        st.markdown(rendered, unsafe_allow_html=True)
+
+def iter_message_segments(content: str) -> Iterator[Tuple[Optional[str], str]]:
+    """Split content into (language, code) fenced blocks and (None, text) prose segments"""
+    last = 0
     
-    if '```' in content:
-        parts = content.split('```')
-        rendered_content = ""
+    for match in _FENCE_RE.finditer(content):
+        text = content[last:match.start()]
+        if text.strip():
+            yield None, text
         
-        for i, part in enumerate(parts):
-            if i % 2 == 0: 
-                if part.strip():
-
-                    processed_part = process_latex(part)
-                    rendered_content += processed_part
-            else:  
-                lines = part.split('\n')
-                language = lines[0] if lines[0] in ['python', 'javascript', 'bash', 'sql', 'html', 'css', 'json', 'xml'] else 'python'
-                code = '\n'.join(lines[1:]) if lines[0] in ['python', 'javascript', 'bash', 'sql', 'html', 'css', 'json', 'xml'] else part
-                
-
-                rendered_content += f"\n```{language}\n{code}\n```\n"
+        language, code = match.group(1), match.group(2)
+        if language not in _LANGS:
+            language = 'python'
         
-        render_to_target(rendered_content)
-    else:
-        processed_content = process_latex(content)
-        render_to_target(processed_content)
+        yield language, code
+        last = match.end()
+    
+    text = content[last:]
+    if text.strip():
+        yield None, text
+
+def preprocess_message(content: str) -> str:
+    """Convert raw message content into the markdown passed to st.markdown"""
+    parts = []
+    
+    for language, text in iter_message_segments(content):
+        if language is None:
+            parts.append(process_latex(text))
+        else:
+            parts.append(f"\n```{language}\n{text}\n```\n")
+    
+    return "".join(parts)
 
 def process_latex(text: str) -> str:
     """Process LaTeX expressions in text"""
     
-    text = re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', text, flags=re.DOTALL)
+    text = _LATEX_BLOCK.sub(r'$$\1$$', text)
     
-    text = re.sub(r'\\\((.*?)\\\)', r'$\1$', text, flags=re.DOTALL)
-    
-    text = re.sub(r'\\boxed\{(.*?)\}', r'\\boxed{\1}', text)
+    text = _LATEX_INLINE.sub(r'$\1$', text)
     
     return text
 
@@ -157,8 +311,11 @@ def display_chat_history():
             with st.chat_message("user"):
                 st.markdown(message['content'])
         else:
+            if 'rendered' not in message:
+                message['rendered'] = preprocess_message(message['content'])
+            
             with st.chat_message("assistant"):
-                render_message_content(message['content'])
+                st.markdown(message['rendered'], unsafe_allow_html=True)
 
 def render_message_with_katex(content: str, placeholder=None):
     """
@@ -174,26 +331,13 @@ def render_message_with_katex(content: str, placeholder=None):
             else:
                 st.markdown(markdown_content)
         
-        
-        if '```' in content:
-            parts = content.split('```')
-            for i, part in enumerate(parts):
-                if i % 2 == 0:
-                    if part.strip():
-                        if '$' in part or '\\[' in part or '\\(' in part:
-                            katex.st_katex(part)
-                        else:
-                            render_to_target(part)
-                else:
-                    lines = part.split('\n')
-                    language = lines[0] if lines[0] in ['python', 'javascript', 'bash', 'sql'] else 'python'
-                    code = '\n'.join(lines[1:]) if lines[0] in ['python', 'javascript', 'bash', 'sql'] else part
-                    st.code(code, language=language)
-        else:
-            if '$' in content or '\\[' in content or '\\(' in content:
-                katex.st_katex(content)
+        for language, text in iter_message_segments(content):
+            if language is not None:
+                st.code(text, language=language)
+            elif '$' in text or '\\[' in text or '\\(' in text:
+                katex.st_katex(text)
             else:
-                render_to_target(content)
+                render_to_target(text)
                 
     except ImportError:
         render_message_content(content, placeholder)
\ No newline at end of file
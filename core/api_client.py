@@ -1,23 +1,111 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
 import json
-from typing import Iterator
+import hashlib
+import atexit
+from collections import namedtuple
+from typing import Dict, Iterator, Optional, Tuple
 import os
-from dotenv import load_dotenv
 import time
-import traceback
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from pathlib import Path
 
-load_dotenv()
+try:
+    import orjson
+    _loads = orjson.loads
+    _encode = orjson.dumps
+    
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:
+    _loads = json.loads
+    
+    def _encode(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+    
+    def _dumps(obj) -> str:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+
+from core.config import load_config
+
+_log_listener = None
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler with a large write buffer, flushed on errors and every flush_interval seconds"""
+    
+    def __init__(self, filename, mode='a', encoding=None, buffer_size=131072, flush_interval=1.0):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        super().__init__(filename, mode=mode, encoding=encoding)
+        
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+        self._flusher.start()
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding)
+    
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+    
+    def emit(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            
+            if record.levelno >= logging.ERROR:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+    
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        super().close()
+
+def stop_log_listener():
+    """Flush queued log records and close the file/console handlers"""
+    global _log_listener
+    
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+def _log_level() -> Tuple[int, Optional[str]]:
+    """Resolve API_LOG_LEVEL (a level name or number), returning DEBUG and the raw value if invalid"""
+    value = (os.getenv("API_LOG_LEVEL") or "DEBUG").strip()
+    
+    if value.isdigit():
+        return int(value), None
+    
+    level = logging.getLevelName(value.upper())
+    if isinstance(level, int):
+        return level, None
+    return logging.DEBUG, value
 
 def setup_logger():
-    """Setup logger with both file and console handlers"""
+    """Setup logger with file and console handlers fed through a background queue listener"""
+    global _log_listener
+    
     logs_dir = Path("api_logs/logs")
     logs_dir.mkdir(parents=True, exist_ok=True)
     
     logger = logging.getLogger('api_client')
-    logger.setLevel(logging.DEBUG)
+    level, invalid_level = _log_level()
+    logger.setLevel(level)
     
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
@@ -34,12 +122,12 @@ def setup_logger():
     
     today = datetime.now().strftime('%Y-%m-%d')
     log_file = logs_dir / f"api_client_{today}.log"
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler = BufferedFileHandler(log_file, encoding='utf-8')
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(detailed_formatter)
     
     error_file = logs_dir / f"api_errors_{today}.log"
-    error_handler = logging.FileHandler(error_file, encoding='utf-8')
+    error_handler = BufferedFileHandler(error_file, encoding='utf-8')
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(detailed_formatter)
     
@@ -47,18 +135,64 @@ def setup_logger():
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(console_formatter)
     
-    logger.addHandler(file_handler)
-    logger.addHandler(error_handler)
-    logger.addHandler(console_handler)
+    stop_log_listener()
     
+    log_queue = queue.Queue(-1)
+    _log_listener = QueueListener(
+        log_queue,
+        file_handler,
+        error_handler,
+        console_handler,
+        respect_handler_level=True
+    )
+    _log_listener.start()
+    
+    logger.addHandler(QueueHandler(log_queue))
+    
+    if invalid_level is not None:
+        logger.warning(f"Unknown API_LOG_LEVEL {invalid_level!r}, falling back to DEBUG")
+    
+    return logger
+
+logger = logging.getLogger('api_client')
+atexit.register(stop_log_listener)
+
+def _get_logger():
+    """Attach the file and console handlers on first use instead of at import"""
+    if _log_listener is None:
+        setup_logger()
     return logger
 
-logger = setup_logger()
+_validation_cache: Dict[str, Tuple[float, bool]] = {}
+
+_SSE_PREFIX = b"data: "
+_SSE_DONE = b"[DONE]"
+
+Delta = namedtuple("Delta", "content finish_reason usage")
+
+def _extract_delta(chunk_data) -> Optional[Delta]:
+    """Return the Delta of one parsed SSE chunk, or None if it carries nothing"""
+    try:
+        choice = chunk_data['choices'][0]
+        finish_reason = choice.get('finish_reason')
+        content = (choice.get('delta') or {}).get('content')
+    except (KeyError, IndexError, TypeError, AttributeError):
+        content = finish_reason = None
+    
+    usage = chunk_data.get('usage') if isinstance(chunk_data, dict) else None
+    
+    if content or finish_reason or usage:
+        return Delta(content or "", finish_reason, usage)
+    return None
+
+class AuthenticationError(Exception):
+    """Raised when OpenRouter rejects the API key"""
 
 class APIClient:
     """OpenRouter API client for RPA Code Assistant"""
     
     def __init__(self, config):
+        _get_logger()
         logger.info("Initializing APIClient...")
         self.config = config
         self.base_url = config.OPENROUTER_BASE_URL
@@ -69,14 +203,37 @@ class APIClient:
             "Content-Type": "application/json"
         }
         self.api_key = os.getenv("OPENROUTER_API_KEY")
+        if self.api_key:
+            self.headers["Authorization"] = f"Bearer {self.api_key}"
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(
+                total=3,
+                read=0,
+                backoff_factor=0.2,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset({"GET", "POST"}),
+                raise_on_status=False
+            )
+        )
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+        
+        self._safe_headers = _dumps({
+            k: v[:20] + '...' if k == 'Authorization' and len(v) > 20 else v 
+            for k, v in self.headers.items()
+        })
         
         logger.info(f"Base URL: {self.base_url}")
         logger.info(f"Model: {self.model}")
         logger.info(f"API Key present: {'Yes' if self.api_key else 'No'}")
         
         if self.api_key:
-            logger.debug(f"API Key length: {len(self.api_key)} characters")
-            logger.debug(f"API Key preview: {self.api_key[:10]}...")
+            logger.debug("API Key length: %d characters", len(self.api_key))
+            logger.debug("API Key preview: %s...", self.api_key[:10])
         else:
             logger.error("No API key found in environment variables!")
             
@@ -84,68 +241,71 @@ class APIClient:
         logger.info(f"Temperature: {config.TEMPERATURE}")
         logger.info("APIClient initialization completed")
     
-    def _update_headers(self):
-        """Update headers with API key from environment"""
-        logger.debug("Updating headers...")
-        
+    def close(self):
+        """Close the pooled HTTP session"""
+        logger.info("Closing API client session")
+        self.session.close()
+    
+    def _cache_key(self) -> str:
+        """Return the validation cache key for the current API key"""
+        return hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()
+    
+    def invalidate(self):
+        """Drop the cached validation result for the current API key"""
         if self.api_key:
-            self.headers["Authorization"] = f"Bearer {self.api_key}"
-            logger.debug("Authorization header added successfully")
+            _validation_cache.pop(self._cache_key(), None)
+            logger.info("API key validation cache invalidated")
+    
+    def validate_api_key(self) -> bool:
+        """Validate if the API key is working, caching success for VALIDATION_TTL seconds"""
+        if self.api_key:
+            cached = _validation_cache.get(self._cache_key())
+            if cached and time.monotonic() - cached[0] < self.config.VALIDATION_TTL:
+                logger.debug("Using cached API key validation result")
+                return cached[1]
+        
+        valid = self._validate_api_key()
+        
+        if valid:
+            _validation_cache[self._cache_key()] = (time.monotonic(), True)
         else:
-            logger.error("No API key available to add to headers")
-            return False
+            self.invalidate()
         
-        safe_headers = {
-            k: v[:20] + '...' if k == 'Authorization' and len(v) > 20 else v 
-            for k, v in self.headers.items()
-        }
-        logger.debug(f"Final headers: {json.dumps(safe_headers, indent=2)}")
-        return True
+        return valid
     
-    def validate_api_key(self) -> bool:
-        """Validate if the API key is working"""
+    def _validate_api_key(self) -> bool:
+        """Check the API key against the key info endpoint (no tokens consumed)"""
         logger.info("Starting API key validation...")
         
         try:
-            if not self._update_headers():
-                logger.error("Failed to update headers - no API key")
+            if not self.api_key:
+                logger.error("No API key available for validation")
                 return False
             
-            if "Authorization" not in self.headers:
-                logger.error("No Authorization header found after update")
-                return False
-            
-            test_data = {
-                "model": self.model,
-                "messages": [{"role": "user", "content": "test"}],
-                "max_tokens": 10
-            }
-            
             logger.info("Sending validation request...")
-            logger.debug(f"Request URL: {self.base_url}/chat/completions")
-            logger.debug(f"Request data: {json.dumps(test_data, indent=2)}")
+            logger.debug("Request URL: %s/auth/key", self.base_url)
+            logger.debug("Request headers: %s", self._safe_headers)
             
             start_time = time.time()
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=test_data,
+            response = self.session.get(
+                f"{self.base_url}/auth/key",
                 timeout=10
             )
             end_time = time.time()
             
             duration = end_time - start_time
             logger.info(f"Request completed in {duration:.2f} seconds")
-            logger.debug(f"Response status code: {response.status_code}")
-            logger.debug(f"Response headers: {dict(response.headers)}")
+            logger.debug("Response status code: %s", response.status_code)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response headers: %s", dict(response.headers))
             
             if response.status_code != 200:
                 logger.error(f"API validation failed with status {response.status_code}")
                 logger.error(f"Response text: {response.text}")
                 
                 try:
-                    error_json = response.json()
-                    logger.error(f"Error details: {json.dumps(error_json, indent=2)}")
+                    error_json = _loads(response.content)
+                    logger.error(f"Error details: {_dumps(error_json)}")
                 except Exception as parse_error:
                     logger.error(f"Could not parse error response as JSON: {parse_error}")
                 
@@ -154,8 +314,9 @@ class APIClient:
                 logger.info("API key validation successful!")
                 
                 try:
-                    response_json = response.json()
-                    logger.debug(f"Validation response: {json.dumps(response_json, indent=2)}")
+                    response_json = _loads(response.content)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Validation response: %s", _dumps(response_json))
                 except Exception as parse_error:
                     logger.warning(f"Could not parse success response as JSON: {parse_error}")
             
@@ -169,51 +330,58 @@ class APIClient:
             return False
         except Exception as e:
             logger.error(f"Unexpected error during API validation: {str(e)}")
+            import traceback
             logger.error(f"Validation traceback: {traceback.format_exc()}")
             return False
     
-    def create_chat_completion(self, messages: list, stream: bool = False) -> Iterator[str]:
-        """Create a chat completion with streaming support"""
+    def create_chat_completion(self, messages: list, stream: bool = False) -> Iterator[Delta]:
+        """Create a chat completion with streaming support, yielding Delta tuples"""
         logger.info("Starting chat completion...")
         logger.info(f"Stream mode: {stream}")
         logger.info(f"Number of messages: {len(messages)}")
         
         preview_messages = messages[-2:] if len(messages) > 2 else messages
-        logger.debug(f"Messages preview: {json.dumps(preview_messages, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Messages preview: %s", _dumps(preview_messages))
+        
+        response = None
         
         try:
-            if not self._update_headers():
-                raise Exception("Failed to update headers - no API key available")
+            if not self.api_key:
+                raise Exception("No API key available")
             
-            data = {
+            logger.debug("Request headers: %s", self._safe_headers)
+            
+            body = _encode({
                 "model": self.model,
                 "messages": messages,
                 "max_tokens": self.config.MAX_TOKENS,
                 "temperature": self.config.TEMPERATURE,
                 "stream": stream
-            }
+            })
             
             logger.info("Request parameters:")
-            logger.info(f"Model: {data['model']}")
-            logger.info(f" Max tokens: {data['max_tokens']}")
-            logger.info(f"Temperature: {data['temperature']}")
-            logger.info(f"Stream: {data['stream']}")
+            logger.info(f"Model: {self.model}")
+            logger.info(f" Max tokens: {self.config.MAX_TOKENS}")
+            logger.info(f"Temperature: {self.config.TEMPERATURE}")
+            logger.info(f"Stream: {stream}")
+            logger.info(f"Body size: {len(body)} bytes")
             
             logger.info("Sending chat completion request...")
             start_time = time.time()
             
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=data,
+                data=body,
                 stream=stream,
-                timeout=60
+                timeout=(self.config.CONNECT_TIMEOUT, self.config.READ_TIMEOUT)
             )
             
             initial_duration = time.time() - start_time
             logger.info(f"Initial response received in {initial_duration:.2f} seconds")
-            logger.debug(f"Response status: {response.status_code}")
-            logger.debug(f"Response headers: {dict(response.headers)}")
+            logger.debug("Response status: %s", response.status_code)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response headers: %s", dict(response.headers))
             
             response.raise_for_status()
             logger.debug("Response status check passed")
@@ -226,7 +394,7 @@ class APIClient:
                 yield from self._process_regular_response(response, start_time)
                 
         except requests.exceptions.Timeout:
-            error_msg = "Request timed out after 60 seconds"
+            error_msg = f"Request timed out (connect {self.config.CONNECT_TIMEOUT}s, read {self.config.READ_TIMEOUT}s)"
             logger.error(error_msg)
             raise Exception("API request failed: Request timed out")
             
@@ -238,8 +406,11 @@ class APIClient:
         except requests.exceptions.HTTPError as he:
             error_msg = f"HTTP error: {str(he)}"
             logger.error(error_msg)
-            if he.response:
+            if he.response is not None:
                 logger.error(f"HTTP error response: {he.response.text}")
+                if he.response.status_code == 401:
+                    self.invalidate()
+                    raise AuthenticationError(f"API request failed: HTTP 401 - {he.response.text}")
                 raise Exception(f"API request failed: HTTP {he.response.status_code} - {he.response.text}")
             else:
                 raise Exception(f"API request failed: {str(he)}")
@@ -247,123 +418,172 @@ class APIClient:
         except requests.exceptions.RequestException as re:
             error_msg = f"Request exception: {str(re)}"
             logger.error(error_msg)
+            import traceback
             logger.error(f"Request exception traceback: {traceback.format_exc()}")
             raise Exception(f"API request failed: {str(re)}")
             
         except Exception as e:
             error_msg = f"Unexpected error: {str(e)}"
             logger.error(error_msg)
+            import traceback
             logger.error(f"Unexpected error traceback: {traceback.format_exc()}")
             raise Exception(f"Unexpected error: {str(e)}")
+        
+        finally:
+            if response is not None:
+                response.close()
     
-    def _process_streaming_response(self, response, start_time) -> Iterator[str]:
+    def _iter_sse_lines(self, response) -> Iterator[bytearray]:
+        """Split the raw urllib3 response body into lines without decoding it"""
+        buffer = bytearray()
+        
+        try:
+            for data in response.raw.stream(8192, decode_content=True):
+                buffer += data
+                start = 0
+                
+                while True:
+                    newline = buffer.find(b'\n', start)
+                    if newline == -1:
+                        break
+                    
+                    end = newline - 1 if buffer[newline - 1:newline] == b'\r' else newline
+                    yield buffer[start:end]
+                    start = newline + 1
+                
+                del buffer[:start]
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        
+        if buffer:
+            yield buffer.rstrip(b'\r')
+    
+    def _process_streaming_response(self, response, start_time) -> Iterator[Delta]:
         """Process streaming response with detailed logging"""
         chunk_count = 0
-        total_content = ""
+        total_chars = 0
         
+        debug = logger.isEnabledFor(logging.DEBUG)
+        loads = _loads
+        next_progress_log = time.monotonic() + 1.0
         logger.debug("Starting to process streaming chunks...")
         
-        for line in response.iter_lines():
+        for line in self._iter_sse_lines(response):
             if line:
-                line = line.decode('utf-8')
-                logger.debug(f"Raw line: {repr(line[:100])}...")
+                if debug:
+                    logger.debug("Raw line: %r...", line[:100])
                 
-                if line.startswith('data: '):
-                    line = line[6:] 
-                    logger.debug(f"After prefix removal: {repr(line[:100])}...")
+                if line.startswith(_SSE_PREFIX):
+                    line = line[len(_SSE_PREFIX):]
+                    if debug:
+                        logger.debug("After prefix removal: %r...", line[:100])
                     
-                    if line.strip() == '[DONE]':
+                    if line.startswith(_SSE_DONE):
                         total_time = time.time() - start_time
                         logger.info(f"Stream completed with [DONE] marker")
-                        logger.info(f"Final stats: {chunk_count} chunks, {len(total_content)} characters, {total_time:.2f}s total")
+                        logger.info(f"Final stats: {chunk_count} chunks, {total_chars} characters, {total_time:.2f}s total")
                         break
                         
                     try:
-                        chunk_data = json.loads(line)
-                        logger.debug(f"Parsed chunk: {json.dumps(chunk_data, indent=2)}")
-                        
-                        if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                            delta = chunk_data['choices'][0].get('delta', {})
-                            
-                            if 'content' in delta and delta['content']:
-                                content = delta['content']
-                                chunk_count += 1
-                                total_content += content
-                                
-                                logger.debug(f"✨ Chunk #{chunk_count}: {repr(content)}")
-                                if chunk_count % 10 == 0:
-                                    logger.info(f"Progress: {chunk_count} chunks, {len(total_content)} chars")
-                                
-                                yield content
-                                
-                            else:
-                                logger.debug("No content in delta or content is empty")
-                        else:
-                            logger.debug("No choices in chunk data")
-                            
-                    except json.JSONDecodeError as je:
+                        chunk_data = loads(line)
+                    except ValueError as je:
                         logger.warning(f"JSON decode error: {str(je)}")
                         logger.warning(f"Problematic line: {repr(line[:200])}")
                         continue
-                        
-                    except Exception as ce:
-                        logger.error(f"Chunk processing error: {str(ce)}")
-                        logger.debug(f"Chunk error traceback: {traceback.format_exc()}")
+                    
+                    if debug:
+                        logger.debug("Parsed chunk: %s", _dumps(chunk_data))
+                    
+                    delta = _extract_delta(chunk_data)
+                    if delta is None:
+                        if debug:
+                            logger.debug("No content in chunk data")
                         continue
-                else:
+                    
+                    if delta.content:
+                        chunk_count += 1
+                        total_chars += len(delta.content)
+                        
+                        if debug:
+                            logger.debug("✨ Chunk #%d: %r", chunk_count, delta.content)
+                        if time.monotonic() >= next_progress_log:
+                            logger.info("Progress: %d chunks, %d chars", chunk_count, total_chars)
+                            next_progress_log = time.monotonic() + 1.0
+                    
+                    if delta.finish_reason:
+                        logger.info(f"Finish reason: {delta.finish_reason}")
+                    
+                    yield delta
+                elif debug:
                     logger.debug("⏭️ Line doesn't start with 'data: ', skipping")
         
         final_time = time.time() - start_time
         logger.info(f"Streaming completed successfully!")
         logger.info(f"Total chunks: {chunk_count}")
-        logger.info(f"Total content length: {len(total_content)} characters")
+        logger.info(f"Total content length: {total_chars} characters")
         logger.info(f"Total processing time: {final_time:.2f} seconds")
         
         if chunk_count == 0:
             logger.error("WARNING: No content chunks were yielded!")
     
-    def _process_regular_response(self, response, start_time) -> Iterator[str]:
+    def _process_regular_response(self, response, start_time) -> Iterator[Delta]:
         """Process regular (non-streaming) response with detailed logging"""
         try:
-            response_data = response.json()
-            logger.debug(f"Full response: {json.dumps(response_data, indent=2)}")
+            response_data = _loads(response.content)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Full response: %s", _dumps(response_data))
             
             if 'choices' in response_data and len(response_data['choices']) > 0:
-                content = response_data['choices'][0]['message']['content']
+                choice = response_data['choices'][0]
+                content = choice['message']['content']
                 content_length = len(content) if content else 0
                 
                 logger.info(f"Extracted content length: {content_length} characters")
-                logger.debug(f"Content preview: {repr(content[:200]) if content else 'None'}...")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Content preview: %s...", repr(content[:200]) if content else 'None')
                 
                 if content:
                     total_time = time.time() - start_time
                     logger.info(f"Non-streaming response processed successfully in {total_time:.2f}s")
-                    yield content
+                    yield Delta(content, choice.get('finish_reason'), response_data.get('usage'))
                 else:
                     logger.error("Content is empty!")
             else:
                 logger.error("No choices in response data")
                 logger.error(f"Response structure keys: {list(response_data.keys())}")
                 
-        except json.JSONDecodeError as je:
+        except ValueError as je:
             logger.error(f"Failed to parse response JSON: {str(je)}")
             logger.error(f"Raw response: {response.text[:500]}...")
             raise Exception(f"Failed to parse API response: {str(je)}")
 
+_client = None
+
 def get_api_client():
-    """Get configured API client instance"""
+    """Get configured API client instance, reusing it across Streamlit reruns"""
+    global _client
+    
+    _get_logger()
+    
+    if _client is not None:
+        logger.debug("Reusing existing API client instance")
+        return _client
+    
     logger.info("Creating API client instance...")
     
     try:
-        from core.config import load_config
         config = load_config()
         logger.debug("Config loaded successfully")
         
-        client = APIClient(config)
+        _client = APIClient(config)
+        atexit.register(_client.close)
         logger.info("API client created successfully")
-        return client
+        return _client
         
     except Exception as e:
         logger.error(f"ERROR creating API client: {str(e)}")
+        import traceback
         logger.error(f"API client creation traceback: {traceback.format_exc()}")
         return None
\ No newline at end of file
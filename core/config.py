@@ -1,22 +1,12 @@
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import ClassVar, Final
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-@dataclass
-class AppConfig:
-    """RPA Code Assistant application configuration"""
-    
-    OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
-    MODEL_NAME: str = "agentica-org/deepcoder-14b-preview:free"
-    
-    APP_TITLE: str = "🤖 RPA Code Assistant"
-    APP_DESCRIPTION: str = "Intelligent assistant for RPA coding and automation"
-    MAX_TOKENS: int = 6000
-    TEMPERATURE: float = 0.7
-    
-    CUSTOM_CSS: str = """
+CUSTOM_CSS: Final[str] = """
     <style>
         .main {
             padding-top: 0rem;
@@ -92,10 +82,35 @@ class AppConfig:
         }
     </style>
     """
+
+@dataclass
+class AppConfig:
+    """RPA Code Assistant application configuration"""
+    
+    OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
+    MODEL_NAME: str = "agentica-org/deepcoder-14b-preview:free"
+    
+    APP_TITLE: str = "🤖 RPA Code Assistant"
+    APP_DESCRIPTION: str = "Intelligent assistant for RPA coding and automation"
+    MAX_TOKENS: int = 6000
+    TEMPERATURE: float = 0.7
+    
+    MAX_HISTORY: int = 200
+    CONTEXT_WINDOW: int = 32768
+    
+    CONNECT_TIMEOUT: float = 10.0
+    READ_TIMEOUT: float = 60.0
+    
+    VALIDATION_TTL: float = 300.0
+    
+    RENDER_BATCH_DELAY: float = 0.05
+    RENDER_BATCH_SIZE: int = 32
+    
+    CUSTOM_CSS: ClassVar[str] = CUSTOM_CSS
     
-    @property
+    @cached_property
     def SYSTEM_PROMPT(self) -> str:
-        """Load system prompt from file"""
+        """Load system prompt from file (read once per config instance)"""
         try:
             prompt_path = os.path.join(os.path.dirname(__file__), '..', 'prompts', 'system_prompt.txt')
             with open(prompt_path, 'r', encoding='utf-8') as f:
@@ -104,8 +119,9 @@ class AppConfig:
             return """You are an expert RPA assistant specializing in automation and coding. 
             Provide complete, working code with proper error handling and documentation."""
 
+@lru_cache(maxsize=1)
 def load_config() -> AppConfig:
-    """Load application configuration"""
+    """Load application configuration (created once per process)"""
     return AppConfig()
 
 CONFIG = load_config()
\ No newline at end of file
@@ -4,11 +4,15 @@ import os
 sys.path.append(os.path.dirname(__file__))
 
 import streamlit as st
+import re
 from typing import Dict
 from core.config import load_config
 
 config = load_config()
 
+_LANGS = frozenset({'python', 'javascript', 'bash', 'sql'})
+_CODE_RE = re.compile(r"```(?:([A-Za-z0-9_+-]*)\n)?(.*?)```", re.DOTALL)
+
 def render_header():
     """Render application header"""
     st.markdown("""
@@ -25,8 +29,12 @@ def render_sidebar():
     with st.sidebar:
         st.markdown("## ⚙️ Settings")
         
-        if st.session_state.get('api_key'):
+        if st.session_state.get('api_key_valid'):
             st.success("🔑 API Key loaded from .env")
+        elif st.session_state.get('api_key') and st.session_state.get('api_key_valid') is None:
+            st.info("🔑 API Key loaded from .env, verifying...")
+        elif st.session_state.get('api_key'):
+            st.warning("🔑 API Key from .env was rejected or could not be verified")
         else:
             st.error("🔑 No API Key found in .env")
         
@@ -34,7 +42,7 @@ def render_sidebar():
         st.markdown("## 🧹 Cleaning")
 
         if st.button("🗑️ Clear Chat", use_container_width=True):
-            st.session_state.messages = []
+            st.session_state.messages.clear()
             st.rerun()
         
         st.markdown("---")
@@ -64,18 +72,20 @@ def render_chat_message(message: Dict[str, str], is_user: bool = True):
 
 def format_code_response(content: str):
     """Format response with code"""
-    parts = content.split('```')
+    last = 0
+    
+    for match in _CODE_RE.finditer(content):
+        text = content[last:match.start()]
+        if text.strip():
+            st.markdown(text)
+        
+        language = match.group(1) if match.group(1) in _LANGS else 'python'
+        st.code(match.group(2), language=language)
+        last = match.end()
     
-    for i, part in enumerate(parts):
-        if i % 2 == 0: 
-            if part.strip():
-                st.markdown(part)
-        else: 
-            lines = part.split('\n')
-            language = lines[0] if lines[0] in ['python', 'javascript', 'bash', 'sql'] else 'python'
-            code = '\n'.join(lines[1:]) if lines[0] in ['python', 'javascript', 'bash', 'sql'] else part
-            
-            st.code(code, language=language)
+    text = content[last:]
+    if text.strip():
+        st.markdown(text)
 
 def render_loading_spinner(message: str = "Generating code..."):
     """Render loading spinner"""